@@ -24,8 +24,11 @@
 from rdrobust import rdrobust, rdplot
 from rdlocrand import rdrandinf, rdwinselect
 from scipy import stats
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
 import rddensity
 import pandas as pd
+import numpy as np
 import matplotlib.pyplot as plt
 
 #------------------#
@@ -139,6 +142,193 @@ clustervar = data.X
 out = rdrobust(data.nextGPA, data.X, vce = 'hc0', cluster = clustervar)
 print(out)
 
+#----------------------------------------------------------#
+# Additional analysis (output not reported in publication) #
+# Wild cluster bootstrap-t with clusters at mass points    #
+#----------------------------------------------------------#
+# Robust bias-corrected (RBC) estimator on one side of the cutoff, as in
+# rdrobust: the order-p fit at h minus its estimated leading bias, which
+# comes from the order-q fit at b. Both pieces are linear in the outcome, so
+# the intercept is sum(ell * y). Returns the conventional and bias-corrected
+# intercepts, the cluster sums s of ell times the order-q residuals (the
+# robust score), and for the bootstrap D (q+1 x G), the cluster contributions
+# to the order-q coefficients, and H (G x q+1), the per-cluster sums of ell
+# times the order-q design
+def _rbcside_numpy(y, x, g, G, c, h, b, p, q):
+    uh = (x - c) / h
+    ub = (x - c) / b
+    wh = np.clip(1 - np.abs(uh), 0, None)
+    wb = np.clip(1 - np.abs(ub), 0, None)
+    Rp = uh[:, None]**np.arange(p + 1)
+    Rq = ub[:, None]**np.arange(q + 1)
+    Mp = np.linalg.solve(Rp.T @ (Rp * wh[:, None]), (Rp * wh[:, None]).T)
+    Mq = np.linalg.solve(Rq.T @ (Rq * wb[:, None]), (Rq * wb[:, None]).T)
+    kappa = (Mp[0] @ uh**(p + 1)) * (h / b)**(p + 1)
+    ell = Mp[0] - kappa * Mq[p + 1]
+    resid = y - Rq @ (Mq @ y)
+    s = np.bincount(g, ell * resid, G)
+    D = np.vstack([np.bincount(g, Mq[j] * resid, G) for j in range(q + 1)])
+    H = np.column_stack([np.bincount(g, ell * Rq[:, j], G)
+                         for j in range(q + 1)])
+    return Mp[0] @ y, ell @ y, s, D, H
+
+# Same side fit as two loops over the data, compiled with numba when the
+# bootstrap is called with engine = "numba": weights, design rows and the
+# Gram/cluster sums are fused with no n x k temporaries
+def _rbcgram_loops(y, uh, ub, p, q):
+    Gp = np.zeros((p + 1, p + 1))
+    Gq = np.zeros((q + 1, q + 1))
+    L = np.zeros(p + 1)
+    yp = np.zeros(p + 1)
+    yq = np.zeros(q + 1)
+    rp = np.empty(p + 1)
+    rq = np.empty(q + 1)
+    for i in range(len(y)):
+        wh = max(1 - abs(uh[i]), 0.0)
+        wb = max(1 - abs(ub[i]), 0.0)
+        for j in range(p + 1):
+            rp[j] = uh[i]**j
+        for j in range(q + 1):
+            rq[j] = ub[i]**j
+        for a in range(p + 1):
+            L[a] += wh * rp[a] * uh[i]**(p + 1)
+            yp[a] += wh * rp[a] * y[i]
+            for k in range(p + 1):
+                Gp[a, k] += wh * rp[a] * rp[k]
+        for a in range(q + 1):
+            yq[a] += wb * rq[a] * y[i]
+            for k in range(q + 1):
+                Gq[a, k] += wb * rq[a] * rq[k]
+    return Gp, Gq, L, yp, yq
+
+def _rbcsums_loops(y, uh, ub, g, G, p, q, ap, aq, beta):
+    s = np.zeros(G)
+    A = np.zeros((q + 1, G))
+    H = np.zeros((G, q + 1))
+    rq = np.empty(q + 1)
+    for i in range(len(y)):
+        wh = max(1 - abs(uh[i]), 0.0)
+        wb = max(1 - abs(ub[i]), 0.0)
+        ell = 0.0
+        for j in range(p + 1):
+            ell += wh * ap[j] * uh[i]**j
+        e = y[i]
+        for j in range(q + 1):
+            rq[j] = ub[i]**j
+            ell -= wb * aq[j] * rq[j]
+            e -= rq[j] * beta[j]
+        s[g[i]] += ell * e
+        for j in range(q + 1):
+            A[j, g[i]] += wb * e * rq[j]
+            H[g[i], j] += ell * rq[j]
+    return s, A, H
+
+# numba is imported and the loops compiled on first use only. The on-disk
+# cache needs the script to be run from a file; otherwise compile uncached
+_numba_kernels = {}
+
+def _rbcside_numba(y, x, g, G, c, h, b, p, q):
+    if not _numba_kernels:
+        from numba import njit
+        for name, f in [("gram", _rbcgram_loops), ("sums", _rbcsums_loops)]:
+            try:
+                _numba_kernels[name] = njit(cache = True)(f)
+            except RuntimeError:
+                _numba_kernels[name] = njit(f)
+    uh = (x - c) / h
+    ub = (x - c) / b
+    Gp, Gq, L, yp, yq = _numba_kernels["gram"](y, uh, ub, p, q)
+    ap = np.linalg.solve(Gp, np.eye(p + 1)[0])
+    aq = (ap @ L) * (h / b)**(p + 1) * np.linalg.solve(Gq, np.eye(q + 1)[p + 1])
+    beta = np.linalg.solve(Gq, yq)
+    s, A, H = _numba_kernels["sums"](y, uh, ub, g, G, p, q, ap, aq, beta)
+    return ap @ yp, ap @ yp - aq @ yq, s, np.linalg.solve(Gq, A), H
+
+# Wild cluster bootstrap-t for the RBC estimate, with rdrobust's robust
+# cluster standard error without its small-sample factor (CR0); the factor
+# is the same in every draw, so the p-value and interval do not depend on
+# it. coef and coef_bc match rdrobust at the same h and b. Each draw
+# multiplies the order-q residuals by one weight per cluster; since the
+# estimator is linear in the outcome, the bootstrap estimate and the
+# residuals of the refit are matrix products with the (clusters x draws)
+# matrix of weights, so nothing is refitted. b defaults to h and q to p + 1,
+# in which case coef_bc is the order-(p+1) fit at h. The fit runs in NumPy;
+# engine = "numba" uses the compiled loops, which only pay off for samples
+# much larger than this one
+def wildclusterboot(y, x, cluster, h, b = None, c = 0, p = 1, q = None,
+                    B = 9999, weights = "rademacher", level = 95, seed = None,
+                    chunk = 1000, n_jobs = 1, engine = "numpy"):
+    if engine not in ("numpy", "numba"):
+        raise ValueError("engine must be 'numpy' or 'numba'")
+    rbcside = _rbcside_numba if engine == "numba" else _rbcside_numpy
+    b = h if b is None else b
+    q = p + 1 if q is None else q
+    if q <= p:
+        raise ValueError("q must be larger than p")
+    y = np.asarray(y, dtype = np.float64)
+    x = np.asarray(x, dtype = np.float64)
+    cluster = np.asarray(cluster)
+    keep = ~(np.isnan(y) | np.isnan(x) | pd.isnull(cluster))
+    keep &= np.abs(x - c) <= max(h, b)
+    y, x, cluster = y[keep], x[keep], cluster[keep]
+    _, g = np.unique(cluster, return_inverse = True)
+    G = g.max() + 1
+
+    # tau = right - left, so the left side enters with a minus sign
+    coef, coef_bc, score, D, H = 0.0, 0.0, np.zeros(G), [], []
+    for side, sign in [(x < c, -1), (x >= c, 1)]:
+        tp, tbc, s, Ds, Hs = rbcside(y[side], x[side], g[side], G, c, h, b,
+                                     p, q)
+        coef += sign * tp
+        coef_bc += sign * tbc
+        score += sign * s
+        D.append(Ds)
+        H.append(sign * Hs)
+    D = np.vstack(D)
+    H = np.hstack(H)
+    se = np.sqrt(np.sum(score**2))
+
+    if weights == "rademacher":
+        support = np.array([-1.0, 1.0])
+    elif weights == "webb":
+        support = np.array([-np.sqrt(1.5), -1, -np.sqrt(0.5),
+                            np.sqrt(0.5), 1, np.sqrt(1.5)])
+    else:
+        raise ValueError("weights must be 'rademacher' or 'webb'")
+
+    # Each block draws from its own child seed: draws are reproducible for a
+    # given seed and chunk, and do not change with n_jobs
+    sizes = [min(chunk, B - s) for s in range(0, B, chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    def draw(size, ss):
+        V = np.random.default_rng(ss).choice(support, size = (G, size))
+        S = score[:, None] * V - H @ (D @ V)
+        return (score @ V) / np.sqrt(np.sum(S**2, axis = 0))
+
+    if n_jobs > 1:
+        with ThreadPoolExecutor(max_workers = n_jobs) as pool:
+            tboot = np.concatenate(list(pool.map(draw, sizes, seeds)))
+    else:
+        tboot = np.concatenate([draw(s, ss) for s, ss in zip(sizes, seeds)])
+
+    tstat = coef_bc / se
+    crit = np.quantile(np.abs(tboot), level / 100)
+    return {"coef": coef, "coef_bc": coef_bc, "se_rb": se, "t_rb": tstat,
+            "G": G, "N_h_l": int(np.sum((x < c) & (x > c - h))),
+            "N_h_r": int(np.sum((x >= c) & (x < c + h))),
+            "pv_rb": np.mean(np.abs(tboot) >= np.abs(tstat)),
+            "ci_rb": (coef_bc - crit * se, coef_bc + crit * se),
+            "tboot": tboot}
+
+h = out.bws.loc['h', 'left']
+b = out.bws.loc['b', 'left']
+boot = wildclusterboot(data.nextGPA, data.X, clustervar, h = h, b = b,
+                       B = 9999, seed = 50)
+print(pd.Series({k: boot[k] for k in ["coef", "coef_bc", "se_rb", "t_rb",
+                                      "pv_rb", "ci_rb", "G", "N_h_l",
+                                      "N_h_r"]}))
+
 #------------------------------------------------------#
 # Snippet 24 (Snippet 4.7 in arXiv pre-print)          #
 # Using rdrobust on the collapsed data (first outcome) #
@@ -150,6 +340,93 @@ print(collapsed.shape)
 out = rdrobust(collapsed.nextGPA, collapsed.X)
 print(out)
 
+#----------------------------------------------------------#
+# Additional analysis (output not reported in publication) #
+# Heterogeneity: rdrobust by subgroup and cross-subgroup   #
+#----------------------------------------------------------#
+# Worker state for rdrobust_bygroup, set once per process (and inherited on
+# fork) so that only the cell indices go through the pool
+_bygroup = {}
+
+def _bygroup_init(yv, xv, vecs, c, min_n, kwargs):
+    _bygroup.update(yv = yv, xv = xv, vecs = vecs, c = c, min_n = min_n,
+                    kwargs = kwargs)
+
+def _bygroup_fit(idx):
+    s = _bygroup
+    vecs = {k: v[idx] for k, v in s["vecs"].items()}
+    try:
+        rd = rdrobust(s["yv"][idx], s["xv"][idx], c = s["c"], **vecs,
+                      **s["kwargs"])
+    except Exception as err:
+        return {"status": f"{type(err).__name__}: {err}"}
+    row = {"N_h_l": rd.N_h[0], "N_h_r": rd.N_h[1],
+           "h_l": rd.bws.iloc[0, 0], "h_r": rd.bws.iloc[0, 1]}
+    if min(rd.N_h) < s["min_n"]:
+        row["status"] = "effective N below min_n"
+        return row
+    row.update({"coef": rd.coef.iloc[0, 0], "se": rd.se.iloc[0, 0],
+                "pv_rb": rd.pv.iloc[2, 0], "ci_l_rb": rd.ci.iloc[2, 0],
+                "ci_r_rb": rd.ci.iloc[2, 1], "status": "fitted"})
+    return row
+
+# The score is sorted once and each grouping is partitioned in a single
+# pass. A cell is fitted only if it has at least min_n observations on each
+# side of the cutoff, and its estimates are kept only if the effective N on
+# each side (observations within the bandwidth) is also at least min_n. The
+# status column records why a cell has no estimates, including any error
+# raised by rdrobust for that cell. cluster, covs and weights are column
+# names, sliced to each cell; other rdrobust options go through kwargs. With
+# n_jobs > 1 the cells are fitted in a pool of forked processes
+def rdrobust_bygroup(data, y, x, by, c = 0, min_n = 20, cluster = None,
+                     covs = None, weights = None, n_jobs = 1, **kwargs):
+    named = {"cluster": cluster, "covs": covs, "weights": weights}
+    named = {k: v for k, v in named.items() if v is not None}
+    extra = [v for cs in named.values()
+             for v in ([cs] if isinstance(cs, str) else cs)]
+    cols = list(dict.fromkeys([y, x] + extra + [g for grp in by for g in grp]))
+    d = data[cols].dropna(subset = [y, x] + extra)
+    d = d.sort_values(x, kind = "stable")
+    yv = d[y].to_numpy()
+    xv = d[x].to_numpy()
+    vecs = {k: d[v].to_numpy() for k, v in named.items()}
+
+    rows = []
+    cells = []
+    for grp in by:
+        # groupby leaves out rows missing in this grouping's own columns
+        for key, idx in d.groupby(grp, sort = True).indices.items():
+            key = key if isinstance(key, tuple) else (key,)
+            n_l = int(np.sum(xv[idx] < c))
+            n_r = len(idx) - n_l
+            row = {"group": " x ".join(grp), "cell": dict(zip(grp, key)),
+                   "N_l": n_l, "N_r": n_r}
+            rows.append(row)
+            if min(n_l, n_r) < min_n:
+                row["status"] = "N below min_n"
+            else:
+                cells.append((row, idx))
+
+    state = (yv, xv, vecs, c, min_n, kwargs)
+    if n_jobs > 1 and "fork" in multiprocessing.get_all_start_methods():
+        with ProcessPoolExecutor(
+                max_workers = n_jobs,
+                mp_context = multiprocessing.get_context("fork"),
+                initializer = _bygroup_init, initargs = state) as pool:
+            fits = list(pool.map(_bygroup_fit, [idx for _, idx in cells]))
+    else:
+        _bygroup_init(*state)
+        fits = [_bygroup_fit(idx) for _, idx in cells]
+        _bygroup.clear()
+    for (row, _), fit in zip(cells, fits):
+        row.update(fit)
+    return pd.DataFrame(rows)
+
+groups = [["male"], ["bpl_north_america"], ["loc_campus1"], ["loc_campus2"],
+          ["loc_campus3"], ["male", "bpl_north_america"]]
+het = rdrobust_bygroup(data, "nextGPA", "X", groups, n_jobs = 4)
+print(het)
+
 #----------------------------------------------------------#
 # Additional analysis (output not reported in publication) #
 # Binomial test with rdwinselect                           #
@@ -24,6 +24,12 @@
 from rdrobust import rdrobust, rdplot
 from rdlocrand import rdrandinf, rdwinselect
 from scipy import stats
+import asyncio
+import contextlib
+import io
+import multiprocessing
+import os
+import threading
 import pandas as pd
 import numpy as np
 
@@ -123,6 +129,134 @@ out = rdrandinf(data.dpresdem, data.X, seed = 50,
 out = rdrandinf(data.dopen, data.X, seed = 50,
                  wl = -0.7652, wr = 0.7652)
 
+#----------------------------------------------------------#
+# Additional analysis (output not reported in publication) #
+# Running rdrandinf and rdwinselect calls concurrently     #
+#----------------------------------------------------------#
+# Runs one job in a forked process and returns (ok, value) once its result
+# arrives on the pipe. If the awaiting task is cancelled, the process is killed
+async def _run_forked(f, args, kwargs):
+    ctx = multiprocessing.get_context("fork")
+    recv, send = ctx.Pipe(duplex = False)
+
+    def target():
+        try:
+            send.send((True, f(*args, **kwargs)))
+        except Exception as err:
+            send.send((False, err))
+
+    proc = ctx.Process(target = target, daemon = True)
+    proc.start()
+    send.close()
+    loop = asyncio.get_running_loop()
+    ready = loop.create_future()
+    loop.add_reader(recv.fileno(), lambda: ready.done() or ready.set_result(None))
+    try:
+        await ready
+        try:
+            return recv.recv()
+        except EOFError:
+            return False, RuntimeError(f"job exited with code {proc.exitcode}")
+    finally:
+        loop.remove_reader(recv.fileno())
+        recv.close()
+        if proc.is_alive():
+            proc.kill()
+        proc.join()
+
+# Without fork the job runs on a daemon thread, which cannot be stopped: if
+# the task is cancelled the job is left to finish, its result is discarded,
+# and it does not hold up interpreter exit
+async def _run_thread(f, args, kwargs):
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+
+    def target():
+        try:
+            result = True, f(*args, **kwargs)
+        except Exception as err:
+            result = False, err
+        with contextlib.suppress(RuntimeError):
+            loop.call_soon_threadsafe(
+                lambda: done.done() or done.set_result(result))
+
+    threading.Thread(target = target, daemon = True).start()
+    return await done
+
+# Progress of a set of jobs: return values and exceptions by job name, and
+# the names of jobs not finished yet or cancelled
+def job_state(jobs):
+    return {"results": {}, "errors": {},
+            "pending": {job[0] for job in jobs}, "cancelled": set()}
+
+# Runs (name, function, args, kwargs) jobs without blocking the event loop,
+# each in its own forked process with at most max_workers at a time, and calls
+# progress(done, total, name) as each one finishes. Progress is kept in state
+# (see job_state), which the caller can pass in to read after a cancellation:
+# a job that raises stores its exception in errors and the other jobs go on.
+# If the task is cancelled, jobs running at that moment are killed, jobs not
+# yet started never start, their names move from pending to cancelled, and
+# the cancellation is re-raised. rdrandinf and rdwinselect seed the global
+# numpy RNG, so without fork the jobs run one at a time on a thread (see
+# _run_thread)
+async def run_jobs(jobs, progress = None, max_workers = None, state = None):
+    if "fork" in multiprocessing.get_all_start_methods():
+        runner = _run_forked
+        slots = asyncio.Semaphore(max_workers or os.cpu_count() or 1)
+    else:
+        runner = _run_thread
+        slots = asyncio.Semaphore(1)
+    state = job_state(jobs) if state is None else state
+
+    async def run(name, f, args, kwargs):
+        async with slots:
+            ok, value = await runner(f, args, kwargs)
+        state["results" if ok else "errors"][name] = value
+        state["pending"].discard(name)
+        if progress is not None:
+            progress(len(jobs) - len(state["pending"]), len(jobs), name)
+
+    tasks = [asyncio.create_task(run(*job)) for job in jobs]
+    try:
+        await asyncio.gather(*tasks)
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions = True)
+        state["cancelled"] |= state["pending"]
+        state["pending"].clear()
+        raise
+    return state
+
+# Stops after the given number of seconds and returns the state so far
+async def run_jobs_for(jobs, seconds, progress = None, max_workers = None):
+    state = job_state(jobs)
+    try:
+        await asyncio.wait_for(run_jobs(jobs, progress, max_workers, state),
+                               seconds)
+    except asyncio.TimeoutError:
+        pass
+    return state
+
+def report(done, total, name):
+    print(f"{done}/{total} done: {name}")
+
+def quietly(f):
+    def run(*args, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return f(*args, **kwargs)
+    return run
+
+# Fisherian confidence interval in the window of Snippet 7, run as a
+# background job with its printed output suppressed and a 2-minute limit
+jobs = [("ci_0.6934", quietly(rdrandinf), (data.Y, data.X),
+         {"wl": -0.6934, "wr": 0.6934, "seed": 50, "ci": ci_vec})]
+ci_job = asyncio.run(run_jobs_for(jobs, 120, progress = report))
+if "ci_0.6934" in ci_job["results"]:
+    print(ci_job["results"]["ci_0.6934"]["ci"])
+else:
+    print(ci_job["errors"], ci_job["cancelled"])
+
 #----------------------------------------------------------#
 # Additional analysis (output not reported in publication) #
 # Density test using rdrandinf                             #
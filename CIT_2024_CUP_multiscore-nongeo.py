@@ -24,6 +24,10 @@
 # Loading packages
 from rdrobust import rdrobust
 from rdmulti import rdms
+from scipy.spatial import cKDTree
+from scipy.stats import norm
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 import pandas as pd
 import numpy as np
 
@@ -52,6 +56,132 @@ data.dist = data.dist * (2 * data.tr - 1)
 out = rdrobust(data.spadies_any, data.dist)
 print(out)
 
+#----------------------------------------------------------#
+# Additional analysis (output not reported in publication) #
+# Effect curve along a dense grid of boundary points       #
+#----------------------------------------------------------#
+# Worker state for rdms_grid, set once per process (and inherited on fork)
+# so that only each point's observations and distances go through the pool
+_grid = {}
+
+def _grid_init(y, vecs, h, level, min_n, kwargs):
+    _grid.update(y = y, vecs = vecs, h = h, level = level, min_n = min_n,
+                 kwargs = kwargs)
+
+def _grid_fit(idx, dist):
+    s = _grid
+    row = {}
+    if s["h"] is not None:
+        row["N_h_l"] = int(np.sum(dist < 0))
+        row["N_h_r"] = len(dist) - row["N_h_l"]
+        if min(row["N_h_l"], row["N_h_r"]) < s["min_n"]:
+            row["status"] = "effective N below min_n"
+            return row
+    vecs = {k: v[idx] for k, v in s["vecs"].items()}
+    try:
+        rd = rdrobust(s["y"][idx], dist, h = s["h"], level = s["level"],
+                      **vecs, **s["kwargs"])
+    except Exception as err:
+        row["status"] = f"{type(err).__name__}: {err}"
+        return row
+    row.update({"N_h_l": rd.N_h[0], "N_h_r": rd.N_h[1],
+                "h": rd.bws.iloc[0, 0]})
+    if min(rd.N_h) < s["min_n"]:
+        row["status"] = "effective N below min_n"
+        return row
+    row.update({"coef": rd.coef.iloc[0, 0], "coef_bc": rd.coef.iloc[1, 0],
+                "se_rb": rd.se.iloc[2, 0], "ci_l": rd.ci.iloc[2, 0],
+                "ci_r": rd.ci.iloc[2, 1], "status": "fitted"})
+    return row
+
+# Same estimand as rdms at each boundary point (C[j], C2[j]): rdrobust on the
+# signed Euclidean distance to the point. The points are processed in blocks.
+# With a common bandwidth h, a KD-tree on the two scores, built once, gives
+# each point of the block the observations within h of it, which gives the
+# same fit as the full sample; with h = None the distances for the block are
+# computed in one pass. covs and cluster are aligned with Y and sliced to the
+# observations of each point. N_h_l and N_h_r always count the observations
+# within the bandwidth on each side; points where either is below min_n get
+# no estimates, and the status column says why, including any error rdrobust
+# raised at that point. With n_jobs > 1 the points are fitted in a pool of
+# forked processes. The uniform band is a Bonferroni band over the points
+# with estimates
+def rdms_grid(Y, X, X2, zvar, C, C2, h = None, level = 95, min_n = 20,
+              block = 50, covs = None, cluster = None, n_jobs = 1, **kwargs):
+    d = pd.DataFrame({"y": Y, "x": X, "x2": X2, "z": zvar})
+    vecs = {}
+    if covs is not None:
+        vecs["covs"] = np.asarray(covs, dtype = np.float64).reshape(len(d), -1)
+    if cluster is not None:
+        vecs["cluster"] = np.asarray(cluster)
+    keep = d.notna().all(axis = 1).to_numpy()
+    for v in vecs.values():
+        keep = keep & ~pd.isnull(v).reshape(len(d), -1).any(axis = 1)
+    d = d[keep]
+    vecs = {k: v[keep] for k, v in vecs.items()}
+    y = d.y.to_numpy()
+    x = d.x.to_numpy()
+    x2 = d.x2.to_numpy()
+    sign = 2 * d.z.to_numpy() - 1
+    C = np.asarray(C, dtype = np.float64)
+    C2 = np.asarray(C2, dtype = np.float64)
+
+    state = (y, vecs, h, level, min_n, kwargs)
+    if n_jobs > 1 and "fork" in multiprocessing.get_all_start_methods():
+        pool = ProcessPoolExecutor(
+            max_workers = n_jobs,
+            mp_context = multiprocessing.get_context("fork"),
+            initializer = _grid_init, initargs = state)
+        fit = pool.map
+    else:
+        pool = None
+        _grid_init(*state)
+        fit = map
+
+    if h is not None:
+        tree = cKDTree(np.column_stack([x, x2]))
+    rows = []
+    try:
+        for s in range(0, len(C), block):
+            js = np.arange(s, min(s + block, len(C)))
+            if h is None:
+                D = np.sqrt((x[:, None] - C[None, js])**2 +
+                            (x2[:, None] - C2[None, js])**2) * sign[:, None]
+                idxs = [slice(None)] * len(js)
+                dists = list(D.T)
+            else:
+                near = tree.query_ball_point(np.column_stack([C[js], C2[js]]),
+                                             h)
+                idxs = [np.asarray(n, dtype = np.intp) for n in near]
+                dists = [np.sqrt((x[i] - C[j])**2 + (x2[i] - C2[j])**2) *
+                         sign[i] for j, i in zip(js, idxs)]
+            rows += [{"c1": C[j], "c2": C2[j], **row}
+                     for j, row in zip(js, fit(_grid_fit, idxs, dists))]
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        else:
+            _grid.clear()
+
+    curve = pd.DataFrame(rows)
+    if "coef_bc" in curve:
+        k = curve.coef_bc.notna().sum()
+        z = norm.ppf(1 - (1 - level / 100) / (2 * k))
+        curve["band_l"] = curve.coef_bc - z * curve.se_rb
+        curve["band_r"] = curve.coef_bc + z * curve.se_rb
+    return curve
+
+# Boundary points along the two edges through cvec and cvec2, with the
+# bandwidth chosen above at (30, 0)
+edge1 = np.arange(0, 30.5, 0.5)
+edge2 = np.arange(1, 51, 1)
+grid_c = np.concatenate([edge1, np.zeros(len(edge2))])
+grid_c2 = np.concatenate([np.zeros(len(edge1)), edge2])
+curve = rdms_grid(data.spadies_any, data.running_sisben, data.running_saber11,
+                  data.tr, grid_c, grid_c2, h = out.bws.iloc[0, 0],
+                  n_jobs = 4)
+print(curve)
+
 #--------------------------------------------------------------#
 # Snippet 35 (Snippet 5.8 in arXiv pre-print)                  #
 # Creating the perpendicular distance to the boundary (step 1) #